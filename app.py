@@ -1,11 +1,17 @@
 # This is a Streamlit application for managing dispatch records. 
 import streamlit as st
-import pandas as pd
-from supabase import create_client, Client
+# pandas is imported inside the helpers that use it (and supabase inside get_supabase()),
+# so a cold start can render the login screen without paying the pandas import cost
 import os
+import math
 from datetime import datetime, date # Ensure date is imported
 import traceback # For detailed error logging
 from io import BytesIO # Import BytesIO for in-memory file handling
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 
 # --- Streamlit Page Configuration (MUST be the first Streamlit command) --- 
@@ -24,8 +30,10 @@ st.markdown(hide_menu_style, unsafe_allow_html=True)
 st.image("images/header.png")
 st.title("Dispatch Register of Hydraulic Division Uri")
 
-# --- Supabase Connection ---
+# --- Supabase Credentials ---
 # It's recommended to use environment variables or Streamlit secrets for these
+# SUPABASE_URL is the project's HTTPS API URL (https://<ref>.supabase.co), not a Postgres DSN: every
+# query goes through PostgREST, which pools its own DB connections, so no pooler (port 6543) is needed here
 SUPABASE_URL = st.secrets.get("SUPABASE_URL", "YOUR_SUPABASE_URL")
 SUPABASE_KEY = st.secrets.get("SUPABASE_KEY", "YOUR_SUPABASE_KEY")
 
@@ -33,16 +41,67 @@ SUPABASE_KEY = st.secrets.get("SUPABASE_KEY", "YOUR_SUPABASE_KEY")
 # --- Supabase Table Names ---
 DISPATCH_TABLE = 'dispatch_records' # Added 'created_by' column referencing 'users.username'
 CONTACTS_TABLE = 'contacts'
-SEQUENCE_TABLE = 'dispatch_sequence'
+SEQUENCE_TABLE = 'dispatch_sequence' # Advanced inside reserve_and_insert_dispatch()
 USERS_TABLE = 'users' # New table for users
 
+# Columns read from DISPATCH_TABLE, in display order (the SELECT list fixes the DataFrame column order)
+DISPATCH_COLUMNS = ['No', 'Date', 'Section', 'Address', 'Subject', 'CC', 'Remarks', 'created_by', 'id']
+SECTIONS = ("ACCTS", "ESTAB", "DB", "CAMP") # Predefined sections, as used in the 'No' (HDU/<section>/...)
+
+# --- Navigation Menu ---
+# Sidebar options (icon + page name) and the page name each maps to, built once
+MENU_OPTIONS = ("✍️ Record New Dispatch", "📊 View Records", "👥 Manage Contacts")
+MENU_MAP = {option: option.split(" ", 1)[1] for option in MENU_OPTIONS}
+CONTACT_PAGES = ("Record New Dispatch", "Manage Contacts") # Pages that need the contacts list
+
+# --- Widget Keys and Layouts ---
+# Keys shared by the contacts widgets and the callbacks that read them; keeping them in one
+# place keeps widget identity stable across reruns
+EDIT_NAME_KEY = "edit_contact_name_input"
+NEW_CONTACT_KEY = "new_contact_name_input"
+UPDATE_CONTACT_KEY = "update_contact_button"
+CANCEL_EDIT_KEY = "cancel_edit_button"
+CONFIRM_DEL_KEY = "confirm_delete_button"
+CANCEL_DEL_KEY = "cancel_delete_button"
+CONTACTS_GRID_KEY = "contacts_grid"
+EDIT_SELECTED_KEY = "edit_selected_button"
+DELETE_SELECTED_KEY = "delete_selected_button"
+PREPARE_EXPORT_KEY = "prepare_export_button"
+
 
 # --- Supabase Connection ---
+@st.cache_resource
+def get_supabase() -> "Client":
+    """Creates the Supabase client once per process and shares it across reruns and sessions.
+
+    Every helper (fetches, inserts, contact add/update/delete) uses this one client, so a click
+    never pays connection setup. Because it is shared by all sessions, don't mutate it per
+    user (e.g. auth sign-in or per-request headers); build a separate client for that instead.
+    """
+    import httpx
+    from supabase import create_client, ClientOptions
+    # One HTTP/2 connection pool reused by every query, so bursts of calls (login, view,
+    # download) don't each pay a new TCP + TLS handshake. Compressed responses need no setup:
+    # httpx already advertises 'br' in Accept-Encoding whenever the brotli package is installed.
+    http_client = httpx.Client(
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+    )
+    try:
+        options = ClientOptions(postgrest_client_timeout=10, httpx_client=http_client)
+    except TypeError:
+        # Older supabase-py has no httpx_client option; its PostgREST session is already
+        # HTTP/2 and lives as long as this cached client, so just use the defaults
+        http_client.close()
+        options = ClientOptions(postgrest_client_timeout=10)
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+
 # Initialize Supabase client only if URL and Key are provided (and not the placeholders)
-supabase: Client = None
+supabase: "Client" = None
 if SUPABASE_URL != "YOUR_SUPABASE_URL" and SUPABASE_KEY != "YOUR_SUPABASE_KEY":
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase = get_supabase()
     except Exception as e:
         st.error(f"Error connecting to Supabase: {e}")
         supabase = None
@@ -51,84 +110,179 @@ else:
     supabase = None
 
 # --- Helper Functions ---
-def fetch_users():
-    """Fetches all users from the Supabase users table for simple plaintext authentication."""
-    if not supabase:
-        st.error("Supabase connection not available.")
-        return {} # Return empty dictionary if supabase is not connected
+# The cached readers below raise instead of returning a fallback: st.cache_data would store the
+# fallback (and replay its st.error banner) until the ttl ran out, even once the DB is back.
+# Call sites handle the error (see _or_error()), so a failure is shown but not cached.
+def _or_error(call, fallback, message):
+    """Returns call(); on an exception shows message with the traceback and returns fallback."""
     try:
-        # Fetch only username and name, as 'password' column does not exist based on the error.
-        # Note: This means the simple plaintext authentication will not verify passwords.
-        response = supabase.table(USERS_TABLE).select("username, name").execute()
-        if response.data:
-            users = {}
-            for user in response.data:
-                # Basic check for required keys before accessing
-                if 'username' in user and 'name' in user:
-                     users[user['username']] = {
-                         'name': user['name']
-                         # Password is not fetched as the column does not exist
-                     }
-                else:
-                     st.warning(f"Skipping user record with missing data: {user.get('username', 'N/A')}")
-            return users
-        else:
-            st.warning("No users found in the database. Please add users to the 'users' table in Supabase.")
-            return {} # Explicitly return empty dictionary if no data
+        return call()
     except Exception as e:
-        st.error(f"Exception fetching users: {e}")
+        st.error(f"{message}: {e}")
         st.error(traceback.format_exc())
-        return {} # Explicitly return empty dictionary on error
-
-
-def fetch_data(start_date=None, end_date=None):
-    """Fetches records from the Supabase table, optionally filtered by date range."""
-    if not supabase:
-        # Removed logging
-        return pd.DataFrame() # Return empty if supabase is not connected
-    try:
-        query = supabase.table(DISPATCH_TABLE).select("*")
-
-        # Ensure dates are formatted correctly for Supabase query (YYYY-MM-DD string)
-        if start_date:
-            query = query.gte('Date', str(start_date))
-        if end_date:
-            query = query.lte('Date', str(end_date))
-
-        # Order by 'No' column if it exists and makes sense for sorting, else by Date/ID
-        # Assuming 'No' format HDU/Section/Start-End might not sort chronologically well.
-        # Let's sort by Date descending, then maybe by id descending as a tie-breaker.
-        query = query.order('Date', desc=True).order('id', desc=True)
-
-        response = query.execute()
-
-        if response.data:
-            df = pd.DataFrame(response.data)
-            # Ensure 'Date' is datetime.date type for display and consistency
-            if 'Date' in df.columns:
-                df['Date'] = pd.to_datetime(df['Date']).dt.date # Keep as date object
-
-            # Ensure 'No' column exists even if empty initially
-            if 'No' not in df.columns:
-                 df['No'] = None
-
-            # Reorder columns for better display - ensure all potential columns are listed
-            cols_order = ['No', 'Date', 'Section', 'Address', 'Subject', 'CC', 'Remarks', 'created_by', 'id', 'created_at']
-            # Filter out columns not present in the dataframe before reordering
-            cols_present = [col for col in cols_order if col in df.columns]
-            df = df[cols_present]
-            return df
-        else:
-            # Return empty DataFrame with expected columns if no data
-            return pd.DataFrame(columns=['No', 'Date', 'Section', 'Address', 'Subject', 'CC', 'Remarks', 'created_by', 'id', 'created_at'])
-    except Exception as e:
-        st.error(f"Error fetching data: {e}")
-        st.error(traceback.format_exc()) # Log full traceback
-        return pd.DataFrame() # Return empty DataFrame on error
-
-def count_cc_recipients(cc_list):
-    """Counts items in the CC list (from multiselect)."""
-    return len(cc_list) if cc_list else 0
+        return fallback
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def fetch_user(username):
+    """Fetches the user's record, or None if the username does not exist; raises on DB errors.
+
+    Note: There is no 'password' column, so the simple plaintext authentication does not verify passwords.
+    """
+    response = supabase.table(USERS_TABLE).select("username,name").eq("username", username).limit(1).execute()
+    return response.data[0] if response.data else None
+
+# Persisted to disk so a restarted server paints the dropdowns from the last snapshot instead of
+# the DB. ttl is ignored with persist, so freshness relies on invalidate_contacts() clearing it.
+# Errors are left to the caller: anything returned here (an empty fallback list, or an st.error
+# banner, which Streamlit replays on every hit) would be stored for all sessions, across restarts.
+@st.cache_data(persist="disk", max_entries=1, show_spinner=False)
+def load_contacts():
+    """Fetches all contacts ordered by name; raises on failure so nothing bad gets cached.
+
+    Returns (contacts_data, contact_names, contacts_by_id); contacts_by_id is built here, once per
+    cache fill, so rerun lookups by id are a dict hit.
+    """
+    response = supabase.table(CONTACTS_TABLE).select("id,name").order("name").execute()
+    contacts_data = response.data or []
+    # Names are NOT NULL in the DB, so no per-row checks; just the names for the dropdown lists
+    contacts_by_id = {contact['id']: contact for contact in contacts_data}
+    return contacts_data, [contact['name'] for contact in contacts_data], contacts_by_id
+
+# Call after any change to the users table so the next rerun re-reads it
+invalidate_users = fetch_user.clear
+
+def invalidate_contacts():
+    """Drops the cached contacts after an add/update/delete and bumps this session's contacts_version.
+
+    The cache itself is cleared rather than keyed by the version: st.cache_data is shared by all
+    sessions, so a per-session counter as the key would serve other sessions a stale list.
+    contacts_version only tells this session's UI that the list changed.
+    """
+    load_contacts.clear() # Also removes the on-disk copy
+    st.session_state['contacts_version'] = st.session_state.get('contacts_version', 0) + 1
+
+
+def _query_records(start_date=None, end_date=None, page=None, page_size=100):
+    """Fetches records from the Supabase table, optionally filtered by date range and limited to one page.
+
+    Raises on DB errors, so the cached callers never store an error result.
+    """
+    import pandas as pd
+    query = supabase.table(DISPATCH_TABLE).select(",".join(DISPATCH_COLUMNS))
+
+    # Ensure dates are formatted correctly for Supabase query (YYYY-MM-DD string)
+    if start_date:
+        query = query.gte('Date', start_date.isoformat())
+    if end_date:
+        query = query.lte('Date', end_date.isoformat())
+
+    # Order by 'No' column if it exists and makes sense for sorting, else by Date/ID
+    # Assuming 'No' format HDU/Section/Start-End might not sort chronologically well.
+    # Let's sort by Date descending, then maybe by id descending as a tie-breaker.
+    query = query.order('Date', desc=True).order('id', desc=True)
+
+    # Bounded page (LIMIT/OFFSET on the server) when a page is requested; page is zero-based
+    if page is not None:
+        query = query.range(page * page_size, (page + 1) * page_size - 1)
+
+    response = query.execute()
+
+    if response.data:
+        # Known column order up front, so pandas doesn't infer it from the row dicts
+        df = pd.DataFrame(response.data, columns=DISPATCH_COLUMNS)
+        # Keep 'Date' as datetime64 (explicit format takes pandas' C parser); display and Excel format it
+        df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d', cache=True)
+        return df
+    # Return empty DataFrame with expected columns if no data
+    return pd.DataFrame(columns=DISPATCH_COLUMNS)
+
+# Bounded: every (range, page, page size) combination is its own entry until the ttl expires
+@st.cache_data(ttl=60, max_entries=128, show_spinner=False)
+def _fetch_window(start_date=None, end_date=None, page=None, page_size=100):
+    """Cached _query_records() for the View Records page; may lag other processes' inserts by the ttl."""
+    return _query_records(start_date, end_date, page, page_size)
+
+def fetch_data(start_date=None, end_date=None, page=None, page_size=100):
+    """Returns records for a date range; a zero-based page fetches just that page (each page is cached separately)."""
+    return _fetch_window(start_date, end_date, page, page_size)
+
+@st.cache_data(ttl=60, max_entries=128, show_spinner=False)
+def count_records(start_date=None, end_date=None):
+    """Counts records in the date range without transferring any rows (used for pagination); raises on DB errors."""
+    query = supabase.table(DISPATCH_TABLE).select("id", count='exact', head=True)
+    if start_date:
+        query = query.gte('Date', start_date.isoformat())
+    if end_date:
+        query = query.lte('Date', end_date.isoformat())
+    response = query.execute()
+    return response.count if response.count is not None else 0
+
+def _parallel(*calls):
+    """Runs independent zero-argument calls (DB reads) on threads and returns their results in order."""
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    ctx = get_script_run_ctx()
+
+    def run(call):
+        add_script_run_ctx(ctx=ctx) # Lets st.cache_data and st.error work off the main thread
+        return call()
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        return list(pool.map(run, calls))
+
+# Same short ttl as count_records(): View Records reruns reuse it instead of re-querying each time
+@st.cache_data(ttl=60, show_spinner=False)
+def latest_dispatch_id():
+    """Returns the highest record id, used as a cheap version tag for cached exports; raises on DB errors."""
+    response = supabase.table(DISPATCH_TABLE).select("id").order('id', desc=True).limit(1).execute()
+    return response.data[0]['id'] if response.data else 0
+
+# Both exports read the whole range through this one frame, so preparing them costs a single
+# full read. Kept in memory only, so max_entries really bounds it (persisted files would pile up,
+# one per insert and range, until a clear()). max_id is part of the key and the rows are read fresh
+# (not from the 60 s _fetch_window cache, which can predate another process's insert), so the
+# frame cached under a max_id holds every record up to it; a new record changes the key.
+@st.cache_data(max_entries=4, show_spinner=False)
+def _export_frame(start_date=None, end_date=None, max_id=None):
+    """Reads the whole date range for the exports, with CC as a comma-separated string."""
+    df_export = _query_records(start_date=start_date, end_date=end_date)
+    # Excel and CSV cells can't hold lists
+    df_export['CC'] = df_export['CC'].str.join(', ')
+    return df_export
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_excel(start_date=None, end_date=None, max_id=None):
+    """Builds the Excel export for the whole date range and returns the workbook bytes."""
+    return _write_workbook(_export_frame(start_date, end_date, max_id))
+
+def _write_workbook(df_excel):
+    """Writes a frame to a single-sheet xlsx row by row and returns the bytes (no Streamlit calls)."""
+    import xlsxwriter
+    output_excel = BytesIO()
+    # xlsxwriter sends NaN to write_number(), which rejects it; pandas (3.x for NULL text too)
+    # uses NaN/NaT for missing values, so turn them into None, which is written as a blank cell
+    df_excel = df_excel.astype(object).where(df_excel.notna(), None)
+
+    # Rows are written in order, so constant_memory can flush each one as the next starts instead
+    # of holding the sheet; datetime cells pick up default_date_format, no per-cell format lookup
+    workbook = xlsxwriter.Workbook(output_excel, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet('Dispatches')
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}) # pandas' header style
+    worksheet.write_row(0, 0, df_excel.columns, header_format)
+    for row_number, row in enumerate(df_excel.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_number, 0, row)
+    workbook.close()
+    return output_excel.getvalue()
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_csv(start_date=None, end_date=None, max_id=None):
+    """Builds the CSV export for the whole date range; a lighter alternative to the workbook."""
+    return _export_frame(start_date, end_date, max_id).to_csv(index=False, date_format='%Y-%m-%d').encode('utf-8')
+
+def invalidate_records():
+    """Clears cached records and counts after inserting so the next view re-reads the table."""
+    _fetch_window.clear()
+    count_records.clear()
+    latest_dispatch_id.clear()
 
 def insert_data(section, date_val, address, cc_list, subject, remarks):
     """Inserts a new record using an atomic sequence number from a DB function."""
@@ -136,103 +290,37 @@ def insert_data(section, date_val, address, cc_list, subject, remarks):
         st.error("Supabase connection not available.")
         return False
     try:
-        # 1. Get the next sequential number from the database function
-        try:
-            rpc_response = supabase.rpc('get_next_dispatch_no').execute()
-            # More robust error checking for RPC calls
-            if hasattr(rpc_response, 'error') and rpc_response.error:
-                 st.error(f"Error calling DB function 'get_next_dispatch_no': {rpc_response.error.get('message', 'Unknown RPC error')}")
-                 return False
-            elif hasattr(rpc_response, 'data') and rpc_response.data is not None: # Check data exists and is not None
-                 next_dispatch_number = rpc_response.data
-            else:
-                 st.error(f"Failed to get next dispatch number. RPC response invalid. Full response: {rpc_response}")
-                 return False
-        except Exception as rpc_error:
-             st.error(f"Exception calling DB function 'get_next_dispatch_no': {rpc_error}")
-             st.error(traceback.format_exc())
-             return False
-
-        # 2. Calculate CC count (number of people in the CC list)
-        cc_count = count_cc_recipients(cc_list)
-
-        # 3. Calculate the End Number for the range
-        # StartNo is next_dispatch_number, EndNo = StartNo + cc_count
-        end_no = next_dispatch_number + cc_count
-
-        # 4. Generate the final 'No' string in the format HDU/Section/StartNo-EndNo
-        # Ensure StartNo and EndNo are the same if cc_count is 0
-        if cc_count == 0:
-            generated_no = f"HDU/{section}/{next_dispatch_number}"
-        else:
-            generated_no = f"HDU/{section}/{next_dispatch_number}-{end_no}"
-
-
-        # 5. Convert CC list to comma-separated string for storage
-        cc_string = ", ".join(cc_list) if cc_list else None
-
-        # 6. Perform a single insert with the generated 'No'
-        data_to_insert = {
-            "Section": section,
-            "Date": str(date_val), # Ensure date is string for Supabase
-            "Address": address,
-            "CC": cc_string,
-            "Subject": subject,
-            "Remarks": remarks,
-            "No": generated_no, # Include the generated range number directly
-            "created_by": st.session_state.get('name') # Add the created_by field
-        }
-        insert_response = supabase.table(DISPATCH_TABLE).insert(data_to_insert).execute()
-
-        # 7. Check insertion result (Supabase-py v1+ style)
-        if insert_response.data and len(insert_response.data) > 0:
-            # 8. Update the sequence table to set last_no to end_no
-            # This ensures the next number will be end_no + 1
-            try:
-                # Use the *end_no* calculated earlier as the new last_no
-                update_response = supabase.table(SEQUENCE_TABLE).update({"last_no": end_no}).eq('id', 1).execute()
-                # Check for errors in update response
-                if not (hasattr(update_response, 'data') and update_response.data):
-                     st.warning(f"Record saved with Dispatch No: {generated_no}, BUT failed to update sequence table. Next number may be incorrect. Response: {update_response}")
-            except Exception as seq_error:
-                st.warning(f"Record saved with Dispatch No: {generated_no}, BUT failed during sequence update: {seq_error}")
-                st.warning(traceback.format_exc())
-
+        # Number reservation (1 + len(CC)), 'No' formatting and the insert all happen in one
+        # DB function (see supabase/migrations), so this is a single race-free round-trip.
+        # CC is a text[] column, PostgREST maps the Python list to a PG array
+        rpc_response = supabase.rpc('reserve_and_insert_dispatch', {
+            "p_section": section,
+            "p_date": date_val.isoformat(), # ISO YYYY-MM-DD string for Supabase
+            "p_address": address,
+            "p_cc": cc_list or [],
+            "p_subject": subject,
+            "p_remarks": remarks,
+            "p_created_by": st.session_state.get('name') # Add the created_by field
+        }).execute()
+
+        # More robust error checking for RPC calls
+        if hasattr(rpc_response, 'error') and rpc_response.error:
+            st.error(f"Error calling DB function 'reserve_and_insert_dispatch': {rpc_response.error.get('message', 'Unknown RPC error')}")
+            return False
+        elif rpc_response.data:
+            generated_no = rpc_response.data
+            invalidate_records()
             st.success(f"Record added successfully with Dispatch No: {generated_no}")
             return True
         else:
-            error_message = "Unknown error."
-            # Check if Supabase returned an error object (newer versions might)
-            if hasattr(insert_response, 'error') and insert_response.error:
-                 error_message = insert_response.error.get('message', str(insert_response.error)) # Get message or string representation
-            elif hasattr(insert_response, 'status_code') and insert_response.status_code != 201: # Check HTTP status if no error object
-                 error_message = f"Insertion failed with status code {insert_response.status_code}. Response: {insert_response.data}"
-
-            st.error(f"Failed to add record: {error_message}")
+            st.error(f"Failed to add record. RPC response invalid. Full response: {rpc_response}")
             return False
     except Exception as e:
-        st.error(f"Error inserting/updating data: {e}")
+        st.error(f"Error inserting data: {e}")
         st.error(traceback.format_exc())
         return False
 
 # --- Address/Contact Management (using Database) ---
-def fetch_contacts():
-    """Fetches all contacts from the database."""
-    if not supabase:
-        return [], [] # Return empty if supabase is not connected
-    try:
-        response = supabase.table(CONTACTS_TABLE).select("id, name").order('name').execute() # Select only needed fields
-        if response.data:
-            # Extract just the names for the dropdown lists
-            contact_names = [contact['name'] for contact in response.data]
-            return response.data, contact_names # Return full data and just names
-        else:
-            return [], [] # Explicitly return empty lists if no data
-    except Exception as e:
-        st.error(f"Error fetching contacts: {e}") # Show error in main area if sidebar fails
-        st.error(traceback.format_exc()) # Log full traceback
-        return [], [] # Explicitly return empty lists on error
-
 def add_contact(name):
     """Adds a new contact to the database."""
     if not name or not name.strip():
@@ -243,30 +331,22 @@ def add_contact(name):
         st.error("Supabase connection not available.")
         return False
     try:
-        # Check if contact already exists (case-insensitive check might be better depending on requirements)
-        # Using ilike for case-insensitive matching (PostgreSQL specific)
-        # check_response = supabase.table(CONTACTS_TABLE).select("id").ilike('name', name.strip()).execute()
-        # Using eq for case-sensitive:
-        check_response = supabase.table(CONTACTS_TABLE).select("id").eq('name', name.strip()).execute()
-
-        if check_response.data and len(check_response.data) > 0:
-            st.warning(f"Contact '{name.strip()}' already exists.")
-            return False
-
-        # Insert new contact
-        insert_response = supabase.table(CONTACTS_TABLE).insert({"name": name.strip()}).execute()
-        if insert_response.data and len(insert_response.data) > 0:
+        # Insert unless the name already exists (UNIQUE constraint on contacts.name), in one round-trip.
+        # returning='minimal' skips the row body; the exact count of inserted rows (0 when
+        # ON CONFLICT DO NOTHING skipped a duplicate) comes back in a header and tells the cases apart.
+        insert_response = supabase.table(CONTACTS_TABLE).upsert({"name": name.strip()}, on_conflict="name", ignore_duplicates=True, returning='minimal', count='exact').execute()
+        if insert_response.count:
+            invalidate_contacts()
             st.success(f"Added contact '{name.strip()}'")
             return True
-        else:
-            error_message = "Unknown error."
-            # Check if Supabase returned an error object (newer versions might)
-            if hasattr(insert_response, 'error') and insert_response.error:
-                 error_message = insert_response.error.get('message', str(insert_response.error))
-            elif hasattr(insert_response, 'status_code') and insert_response.status_code != 201:
-                 error_message = f"Add contact failed with status code {insert_response.status_code}. Response: {insert_response.data}"
+        # Check if Supabase returned an error object (newer versions might)
+        elif hasattr(insert_response, 'error') and insert_response.error:
+            error_message = insert_response.error.get('message', str(insert_response.error))
             st.error(f"Failed to add contact: {error_message}")
             return False
+        else:
+            st.warning(f"Contact '{name.strip()}' already exists.")
+            return False
     except Exception as e:
         st.error(f"Error adding contact: {e}")
         st.error(traceback.format_exc())
@@ -283,31 +363,24 @@ def update_contact(contact_id, new_name):
         return False
 
     try:
-        # Check if new name already exists for a *different* contact ID
-        check_response = supabase.table(CONTACTS_TABLE).select("id").eq('name', new_name.strip()).execute()
-        if check_response.data:
-            for contact in check_response.data:
-                if contact['id'] != contact_id:
-                    st.warning(f"Contact name '{new_name.strip()}' already exists.")
-                    return False
-
-        # Update contact
-        update_response = supabase.table(CONTACTS_TABLE).update({"name": new_name.strip()}).eq('id', contact_id).execute()
-        if update_response.data and len(update_response.data) > 0:
+        # Rename in a DB function that reports a unique-name clash as a status (see supabase/migrations)
+        rpc_response = supabase.rpc('rename_contact', {'cid': contact_id, 'new_name': new_name.strip()}).execute()
+        status = rpc_response.data
+        if status == 'updated':
+            invalidate_contacts()
             st.success(f"Updated contact to '{new_name.strip()}'")
             return True
+        elif status == 'duplicate':
+            st.warning(f"Contact name '{new_name.strip()}' already exists.")
+            return False
         else:
-            error_message = "Unknown error."
+            if status == 'not_found':
+                error_message = "Contact no longer exists."
             # Check if Supabase returned an error object (newer versions might)
-            if hasattr(update_response, 'error') and update_response.error:
-                 error_message = update_response.error.get('message', str(update_response.error))
-                 # Check for potential unique constraint violation if name didn't change but triggered check
-                 if "duplicate key value violates unique constraint" in error_message:
-                      # This case should ideally be caught by the check above, but handle defensively
-                      st.warning(f"Contact name '{new_name.strip()}' likely already exists (or no change made).")
-                      return False # Treat as non-success
-            elif hasattr(update_response, 'status_code') and update_response.status_code != 200: # Check for non-200 status on update
-                 error_message = f"Update contact failed with status code {update_response.status_code}. Response: {update_response.data}"
+            elif hasattr(rpc_response, 'error') and rpc_response.error:
+                 error_message = rpc_response.error.get('message', str(rpc_response.error))
+            else:
+                 error_message = f"Unexpected response from 'rename_contact'. Response: {rpc_response.data}"
 
             st.error(f"Failed to update contact: {error_message}")
             return False
@@ -322,19 +395,17 @@ def delete_contact(contact_id_to_delete, contact_name):
         st.error("Supabase connection not available.")
         return False
     try:
-        # Check if contact is used in 'Address' field of dispatch_records
+        # Usage check and delete run in one DB function (see supabase/migrations), one round-trip.
+        # Usage counts come from the trigger-maintained contact_usage table, a primary-key lookup.
+        # The function reads the name by id itself; contact_name is only used for the messages.
         # Note: This assumes 'Address' stores the *name*, not an ID. Adjust if it stores ID.
-        check_address = supabase.table(DISPATCH_TABLE).select("id", count='exact').eq('Address', contact_name).execute()
-
-        # Check if contact is used in 'CC' field (as part of a comma-separated string)
-        # Using 'like' can be slow on large tables without proper indexing.
-        # Consider more robust checks if performance becomes an issue.
-        check_cc = supabase.table(DISPATCH_TABLE).select("id", count='exact').like('CC', f"%{contact_name}%").execute()
+        rpc_response = supabase.rpc('delete_contact_if_unused', {'cid': contact_id_to_delete}).execute()
+        result = rpc_response.data if isinstance(rpc_response.data, dict) else {}
+        status = result.get('status')
 
-        address_count = check_address.count if check_address.count is not None else 0
-        cc_count = check_cc.count if check_cc.count is not None else 0
-
-        if address_count > 0 or cc_count > 0:
+        if status == 'in_use':
+            address_count = result.get('address_count') or 0
+            cc_count = result.get('cc_count') or 0
             usage_message = []
             if address_count > 0:
                 usage_message.append(f"'{contact_name}' is used as Address in {address_count} record(s)")
@@ -342,19 +413,18 @@ def delete_contact(contact_id_to_delete, contact_name):
                 usage_message.append(f"'{contact_name}' is mentioned in CC in {cc_count} record(s)")
             st.warning(f"Cannot delete: {', '.join(usage_message)}.")
             return False
-
-        # Delete contact if not used
-        delete_response = supabase.table(CONTACTS_TABLE).delete().eq('id', contact_id_to_delete).execute()
-        if delete_response.data and len(delete_response.data) > 0:
+        elif status == 'deleted':
+            invalidate_contacts()
             st.success(f"Contact '{contact_name}' deleted")
             return True
         else:
-            error_message = "Unknown error."
+            if status == 'not_found':
+                error_message = "Contact no longer exists."
             # Check if Supabase returned an error object (newer versions might)
-            if hasattr(delete_response, 'error') and delete_response.error:
-                 error_message = delete_response.error.get('message', str(delete_response.error))
-            elif hasattr(delete_response, 'status_code') and delete_response.status_code != 200: # Check for non-200 status on delete
-                 error_message = f"Delete contact failed with status code {delete_response.status_code}. Response: {delete_response.data}"
+            elif hasattr(rpc_response, 'error') and rpc_response.error:
+                 error_message = rpc_response.error.get('message', str(rpc_response.error))
+            else:
+                 error_message = f"Unexpected response from 'delete_contact_if_unused'. Response: {rpc_response.data}"
 
             st.error(f"Failed to delete contact: {error_message}")
             return False
@@ -363,21 +433,88 @@ def delete_contact(contact_id_to_delete, contact_name):
         st.error(traceback.format_exc())
         return False
 
-# --- Fetch Users and Contacts ---
-users = {}
-contacts_data, contact_names = [], []
-if supabase: # Only fetch if supabase client is initialized
-    users = fetch_users()
-    contacts_data, contact_names = fetch_contacts()
+# --- Manage Contacts Panels ---
+# Session-state values that mean "no contact being edited" / "no deletion pending"
+_RESET_EDIT = {"edit_contact_id": None, "edit_contact_name": None}
+_RESET_DELETE = {"delete_contact_id": None, "contact_to_delete_name": None, "confirm_delete": False}
+
+def _two_cols():
+    """Returns a fresh equal-width pair of columns (layouts are rebuilt every run, never cached)."""
+    return st.columns(2)
+
+def _finalize(**resets):
+    """Applies session-state resets after an action; also usable as on_click=_finalize, kwargs=_RESET_EDIT."""
+    st.session_state.update(resets)
+
+# Fragments: clicking their buttons reruns only the panel, not the whole script. Button
+# handlers are on_click callbacks, so state is updated before that rerun and no extra
+# st.rerun() is needed; a full rerun happens only when the contacts list itself changed.
+def _rerun_if_contacts_changed():
+    """Escalates a fragment rerun to a full rerun when a callback changed the contacts list."""
+    if st.session_state.get('contacts_version', 0) != rendered_contacts_version:
+        st.rerun()
+
+def _on_add_contact():
+    if add_contact(st.session_state[NEW_CONTACT_KEY]):
+        _finalize(**_RESET_EDIT, **_RESET_DELETE) # Reset edit and delete state after adding
+
+def _on_update_contact():
+    if update_contact(st.session_state.edit_contact_id, st.session_state[EDIT_NAME_KEY]):
+        _finalize(**_RESET_EDIT) # Clear edit state on successful update
+
+def _on_confirm_delete():
+    if delete_contact(st.session_state.delete_contact_id, st.session_state.contact_to_delete_name):
+        _finalize(**_RESET_DELETE) # Clear delete state on successful deletion
+
+@st.fragment
+def edit_contact_panel():
+    """Renders the Edit Contact form for st.session_state.edit_contact_id."""
+    _rerun_if_contacts_changed()
+    if not st.session_state.edit_contact_id: # Contact ids start at 1, so None is the only falsy value
+        return
+    # contacts_by_id is the dict built once per cache fill, so this is a hash lookup, not a scan
+    if st.session_state.edit_contact_id not in contacts_by_id:
+        st.warning("Contact not found for editing.")
+        # Clear invalid edit state; the next run skips the panel without needing another rerun
+        _finalize(**_RESET_EDIT)
+        return
+    st.subheader("Edit Contact")
+    with st.form("edit_contact_form", clear_on_submit=False): # Don't clear on submit immediately
+        # Pre-fill the input with the current contact name
+        st.text_input("Edit Name*", value=st.session_state.edit_contact_name, key=EDIT_NAME_KEY)
+        col_update, col_cancel = _two_cols()
+        with col_update:
+            st.form_submit_button("Update Contact", key=UPDATE_CONTACT_KEY, on_click=_on_update_contact)
+        with col_cancel:
+            st.form_submit_button("Cancel", key=CANCEL_EDIT_KEY, on_click=_finalize, kwargs=_RESET_EDIT)
+
+@st.fragment
+def delete_confirm_panel():
+    """Renders the Confirm Deletion prompt for st.session_state.delete_contact_id."""
+    _rerun_if_contacts_changed()
+    if not st.session_state.confirm_delete:
+        return
+    st.subheader("Confirm Deletion")
+    st.warning(f"Are you sure you want to delete contact '{st.session_state.contact_to_delete_name}'?")
+    # A form batches the choice into one submit; the callbacks run before the rerun
+    with st.form("delete_confirm_form", clear_on_submit=True):
+        col_confirm_delete, col_cancel_delete = _two_cols()
+        with col_confirm_delete:
+            st.form_submit_button("Yes, Delete", key=CONFIRM_DEL_KEY, on_click=_on_confirm_delete)
+        with col_cancel_delete:
+            st.form_submit_button("Cancel", key=CANCEL_DEL_KEY, on_click=_finalize, kwargs=_RESET_DELETE)
 
 # --- Simple Login Logic ---
-# Initialize session state for authentication status if not already present
-if 'authentication_status' not in st.session_state:
-    st.session_state['authentication_status'] = None
-if 'username' not in st.session_state:
-    st.session_state['username'] = None
-if 'name' not in st.session_state:
-    st.session_state['name'] = None
+# Initialize every session key once, so later branches read plain values and never hit a missing key
+_SESSION_DEFAULTS = {"authentication_status": None, "username": None, "name": None, "export_prepared_for": None, **_RESET_EDIT, **_RESET_DELETE}
+for key, value in _SESSION_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
+
+# --- Fetch Contacts ---
+# Filled in by the main logic below, only on the pages that show contacts
+contacts_data, contact_names, contacts_by_id = [], [], {}
+# Version of the list rendered by this full run; fragments compare against it
+rendered_contacts_version = st.session_state.get('contacts_version', 0)
 
 # Display login form if not authenticated
 if st.session_state['authentication_status'] is None or st.session_state['authentication_status'] is False:
@@ -407,15 +544,22 @@ if st.session_state['authentication_status'] is None or st.session_state['authen
         if login_button:
             # Note: Password check removed as the 'password' column does not exist in the database.
             # This login will currently only check if the username exists.
-            if input_username in users:
-                st.session_state['authentication_status'] = True
-                st.session_state['username'] = input_username
-                st.session_state['name'] = users[input_username]['name']
-                st.success("Logged in successfully!")
-                st.rerun() # Rerun to show authenticated content
+            try:
+                user = fetch_user(input_username) if supabase else None
+            except Exception as e:
+                # Not cached and the login state is left as is, so retrying works once the DB is back
+                st.error(f"Exception fetching user: {e}")
+                st.error(traceback.format_exc())
             else:
-                st.error("Incorrect username") # Modified error message
-                st.session_state['authentication_status'] = False # Explicitly set to False on failure
+                if user:
+                    st.session_state['authentication_status'] = True
+                    st.session_state['username'] = input_username
+                    st.session_state['name'] = user['name']
+                    st.success("Logged in successfully!")
+                    st.rerun() # Rerun to show authenticated content
+                else:
+                    st.error("Incorrect username") # Modified error message
+                    st.session_state['authentication_status'] = False # Explicitly set to False on failure
 
 # --- Main Application Logic ---
 # Only show content if authenticated
@@ -447,14 +591,14 @@ if st.session_state['authentication_status']:
         st.rerun() # Rerun to show login form
 
     st.sidebar.title("Navigation")
-    menu = ["Record New Dispatch", "View Records", "Manage Contacts"]
-    menu_icons = ["✍️", "📊", "👥"]
-    menu_options = [f"{icon} {item}" for icon, item in zip(menu_icons, menu)]
-
     # Use index=0 to default to the first option if needed, or keep as is
-    choice_with_icon = st.sidebar.radio("Menu", menu_options, label_visibility="collapsed")
-    # Extract the actual choice text without the icon
-    choice = choice_with_icon.split(" ", 1)[1]
+    choice = MENU_MAP[st.sidebar.radio("Menu", MENU_OPTIONS, label_visibility="collapsed")]
+
+    # View Records never touches contacts, so it skips the load (and its DB read after an invalidation)
+    if supabase and choice in CONTACT_PAGES:
+        # Served from the in-memory or on-disk cache; the DB is only read after invalidate_contacts()
+        # On an error the empty defaults stay; nothing is cached, so the next rerun tries the DB again
+        contacts_data, contact_names, contacts_by_id = _or_error(load_contacts, ([], [], {}), "Exception fetching contacts")
 
     # --- About (Expandable Section) ---
     with st.sidebar.expander("About this App", expanded=False):
@@ -478,12 +622,11 @@ if st.session_state['authentication_status']:
         st.divider()
         # Use columns for better layout
         with st.form("dispatch_form", clear_on_submit=True):
-            col1, col2 = st.columns(2)
+            col1, col2 = _two_cols()
 
             with col1:
                 # Section Dropdown
-                sections = ["ACCTS", "ESTAB", "DB", "CAMP"] # Predefined sections
-                dispatch_section = st.selectbox("Section*", options=sections, index=None, placeholder="Select section...", key="dispatch_section")
+                dispatch_section = st.selectbox("Section*", options=SECTIONS, index=None, placeholder="Select section...", key="dispatch_section")
                 # Address Dropdown (Uses contacts fetched earlier)
                 dispatch_address = st.selectbox("Address*", options=contact_names, index=None, placeholder="Select address...", key="dispatch_address")
 
@@ -518,19 +661,36 @@ if st.session_state['authentication_status']:
         st.subheader("📊 View Dispatch Records")
         st.divider()
 
-        # Date range filter
-        col_start_date, col_end_date = st.columns(2)
-        with col_start_date:
-            start_date_filter = st.date_input("Start Date", value=None, key="start_date_filter")
-        with col_end_date:
-            end_date_filter = st.date_input("End Date", value=None, key="end_date_filter")
-
-        # Fetch data based on selected date range
+        # Date range filter, inside a form so picking dates doesn't rerun the page or query
+        # Supabase; the values only change (and the fetch only runs) when Apply is pressed
+        with st.form("filter_form"):
+            col_start_date, col_end_date = _two_cols()
+            with col_start_date:
+                start_date_filter = st.date_input("Start Date", value=None, key="start_date_filter")
+            with col_end_date:
+                end_date_filter = st.date_input("End Date", value=None, key="end_date_filter")
+            st.form_submit_button("Apply")
+
+        # Pagination controls: only one page of rows is fetched and rendered per rerun
+        # The count and the export's version tag are independent round-trips, so fetch them together
+        total_records, max_dispatch_id = _parallel(
+            lambda: _or_error(lambda: count_records(start_date=start_date_filter, end_date=end_date_filter), 0, "Error counting records"),
+            lambda: _or_error(latest_dispatch_id, None, "Error checking latest record")
+        )
+        col_page_size, col_page = _two_cols()
+        with col_page_size:
+            page_size = st.selectbox("Rows per page", [50, 100, 500], index=1)
+        total_pages = max(1, math.ceil(total_records / page_size))
+        with col_page:
+            page_number = st.number_input("Page", min_value=1, max_value=total_pages, value=1, step=1)
+
+        # Fetch the selected page based on selected date range
         with st.spinner("Fetching records..."):
-             df_records = fetch_data(start_date=start_date_filter, end_date=end_date_filter)
-        
-        if not df_records.empty:
-            st.write(f"Displaying {len(df_records)} records for the selected range.")
+             df_records = _or_error(lambda: fetch_data(start_date=start_date_filter, end_date=end_date_filter, page=page_number - 1, page_size=page_size), None, "Error fetching data")
+
+        # None means the fetch failed and its error is already shown
+        if df_records is not None and not df_records.empty:
+            st.write(f"Displaying {len(df_records)} of {total_records} records for the selected range (page {page_number} of {total_pages}).")
             # Hide the download button using CSS
             # st.markdown(
             #     """
@@ -543,93 +703,104 @@ if st.session_state['authentication_status']:
             #     unsafe_allow_html=True,
             # )
             # Display filtered data
-            st.dataframe(df_records, use_container_width=True, hide_index=True)
-
-            st.divider()
-            st.subheader("Download Options")
-
-            col_excel, col_pdf = st.columns(2)
-
-            with col_excel:
-                # --- Excel Download ---
-                try:
-                    output_excel = BytesIO()
-                    # Make a copy to avoid modifying the displayed df
-                    df_excel = df_records.copy()
-                    # Convert date objects to strings for Excel if needed
-                    if 'Date' in df_excel.columns:
-                        df_excel['Date'] = pd.to_datetime(df_excel['Date']).dt.strftime('%Y-%m-%d')
-
-                    with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
-                        df_excel.to_excel(writer, index=False, sheet_name='Dispatches')
-                    excel_data = output_excel.getvalue()
-
-                    # Use selected dates in the file name
-                    excel_file_name = f'dispatch_records_{start_date_filter or "all"}_to_{end_date_filter or "all"}.xlsx'
-
-                    st.download_button(
-                        label="📄 Download as Excel (.xlsx)",
-                        data=excel_data,
-                        file_name=excel_file_name,
-                        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                        key='excel_download_btn'
-                    )
-                except ImportError:
-                    st.error("Please install 'openpyxl' to enable Excel downloads. Run: pip install openpyxl")
-                except Exception as e:
-                    st.error(f"Error generating Excel file: {e}")
-                    st.error(traceback.format_exc())
-
-            with col_pdf:
-                st.write("PDF generation can be added.")
-
-        else:
+            st.dataframe(
+                df_records,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "Date": st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+                    "CC": st.column_config.ListColumn("CC") # CC is a native list (text[]) column
+                }
+            )
+
+            # Without the version tag an export could be cached under the wrong key, so skip it (error already shown)
+            if max_dispatch_id is not None:
+                st.divider()
+                st.subheader("Download Options")
+
+                export_key = (start_date_filter, end_date_filter, max_dispatch_id)
+                if st.session_state.export_prepared_for != export_key:
+                    # Nothing is read or built until asked: every insert changes the key, and building
+                    # eagerly would cost a full-range read and an xlsx build on the next view, downloaded or not
+                    st.button("Prepare downloads", key=PREPARE_EXPORT_KEY, on_click=_finalize, kwargs={"export_prepared_for": export_key})
+                else:
+                    col_excel, col_pdf = _two_cols()
+
+                    with col_excel:
+                        # --- Excel Download ---
+                        try:
+                            # Workbook bytes are cached per date range and latest id, so reruns don't rebuild the file
+                            excel_data = build_excel(start_date_filter, end_date_filter, max_dispatch_id)
+
+                            # Use selected dates in the file name
+                            excel_file_name = f'dispatch_records_{start_date_filter or "all"}_to_{end_date_filter or "all"}.xlsx'
+
+                            st.download_button(
+                                label="📄 Download as Excel (.xlsx)",
+                                data=excel_data,
+                                file_name=excel_file_name,
+                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                                key='excel_download_btn'
+                            )
+                        except ImportError:
+                            st.error("Please install 'xlsxwriter' to enable Excel downloads. Run: pip install xlsxwriter")
+                        except Exception as e:
+                            st.error(f"Error generating Excel file: {e}")
+                            st.error(traceback.format_exc())
+
+                        # --- CSV Download ---
+                        try:
+                            # Plain text is several times cheaper to build than the xlsx XML; same cached frame and key
+                            csv_data = build_csv(start_date_filter, end_date_filter, max_dispatch_id)
+                            st.download_button(
+                                label="🧾 Download as CSV (.csv)",
+                                data=csv_data,
+                                file_name=f'dispatch_records_{start_date_filter or "all"}_to_{end_date_filter or "all"}.csv',
+                                mime='text/csv',
+                                key='csv_download_btn'
+                            )
+                        except Exception as e:
+                            st.error(f"Error generating CSV file: {e}")
+                            st.error(traceback.format_exc())
+
+                    with col_pdf:
+                        st.write("PDF generation can be added.")
+
+        elif df_records is not None:
             st.info("No records found for the selected date range.")
 
     elif choice == "Manage Contacts":
         st.subheader("👥 Manage Contacts")
         st.divider()
 
-        # Initialize session state for editing if not already present
-        if 'edit_contact_id' not in st.session_state:
-            st.session_state.edit_contact_id = None
-        if 'delete_contact_id' not in st.session_state:
-            st.session_state.delete_contact_id = None
-        if 'confirm_delete' not in st.session_state:
-            st.session_state.confirm_delete = False
-        if 'contact_to_delete_name' not in st.session_state:
-            st.session_state.contact_to_delete_name = None
-
-
         # Display existing contacts with Edit/Delete options
         st.subheader("Existing Contacts")
         if contacts_data:
-            # Use columns for layout: Name | Edit | Delete
-            # Adjust column widths as needed
-            cols = st.columns([0.6, 0.2, 0.2])
-            cols[0].write("Name")
-            cols[1].write("Edit")
-            cols[2].write("Delete")
-            st.divider() # Separator for header
-
-            for contact in contacts_data:
-                col1, col2, col3 = st.columns([0.6, 0.2, 0.2])
-                col1.write(contact['name'])
-
-                # Edit button
-                if col2.button("Edit", key=f"edit_{contact['id']}"):
-                    st.session_state.edit_contact_id = contact['id']
-                    st.session_state.edit_contact_name = contact['name'] # Store current name for pre-filling form
-                    st.session_state.confirm_delete = False # Reset delete confirmation
-                    st.rerun() # Rerun to show edit form
-
-                # Delete button
-                if col3.button("Delete", key=f"delete_{contact['id']}"):
-                    st.session_state.delete_contact_id = contact['id']
-                    st.session_state.contact_to_delete_name = contact['name']
-                    st.session_state.confirm_delete = True # Show confirmation
-                    st.session_state.edit_contact_id = None # Reset edit state
-                    st.rerun() # Rerun to show confirmation
+            # One selectable grid plus two buttons instead of a write + 2 buttons per contact.
+            # The key follows contacts_version so a changed list starts with no stale selection.
+            contacts_event = st.dataframe(
+                contacts_data,
+                column_order=("name",),
+                column_config={"name": "Name"},
+                use_container_width=True,
+                hide_index=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                key=f"{CONTACTS_GRID_KEY}_{rendered_contacts_version}"
+            )
+            selected_rows = contacts_event.selection.rows
+            selected = contacts_data[selected_rows[0]] if selected_rows and selected_rows[0] < len(contacts_data) else None
+
+            col_edit, col_delete = _two_cols()
+            # Callbacks set the panel state before the rerun, so the panels below read it straight away
+            with col_edit:
+                # Store current name for pre-filling form; reset delete confirmation
+                st.button("Edit selected", key=EDIT_SELECTED_KEY, disabled=selected is None, on_click=_finalize,
+                          kwargs=selected and {**_RESET_DELETE, "edit_contact_id": selected['id'], "edit_contact_name": selected['name']})
+            with col_delete:
+                # Show confirmation; reset edit state
+                st.button("Delete selected", key=DELETE_SELECTED_KEY, disabled=selected is None, on_click=_finalize,
+                          kwargs=selected and {**_RESET_EDIT, "delete_contact_id": selected['id'], "contact_to_delete_name": selected['name'], "confirm_delete": True})
 
         else:
             st.info("No contacts found.")
@@ -639,75 +810,19 @@ if st.session_state['authentication_status']:
         # --- Add New Contact Form ---
         st.subheader("Add New Contact")
         with st.form("add_contact_form", clear_on_submit=True):
-            new_contact_name = st.text_input("Contact Name*", key="new_contact_name_input") # Changed key to avoid conflict
-            add_contact_submitted = st.form_submit_button("Add Contact")
-
-            if add_contact_submitted:
-                if add_contact(new_contact_name):
-                    # Refresh contacts list after adding
-                    st.session_state.edit_contact_id = None # Reset edit state
-                    st.session_state.delete_contact_id = None # Reset delete state
-                    st.session_state.confirm_delete = False # Reset delete confirmation
-                    st.rerun() # Rerun to update the displayed list
+            st.text_input("Contact Name*", key=NEW_CONTACT_KEY)
+            # The add runs in a callback, before the list above is drawn, so the natural
+            # post-submit rerun already shows the new contact; no extra st.rerun() needed
+            st.form_submit_button("Add Contact", on_click=_on_add_contact)
 
 
         st.divider()
 
+        # At most one panel per run: the Edit and Delete buttons each reset the other's state,
+        # and the elif keeps it that way even if both flags were ever set
         # --- Edit Contact Form (appears when a contact is selected for editing) ---
-        if st.session_state.edit_contact_id is not None:
-            st.subheader("Edit Contact")
-            # Find the contact data for the selected ID
-            contact_to_edit = next((item for item in contacts_data if item['id'] == st.session_state.edit_contact_id), None)
-
-            if contact_to_edit:
-                with st.form("edit_contact_form", clear_on_submit=False): # Don't clear on submit immediately
-                    # Pre-fill the input with the current contact name
-                    edited_contact_name = st.text_input("Edit Name*", value=st.session_state.edit_contact_name, key="edit_contact_name_input")
-                    col_update, col_cancel = st.columns(2)
-                    with col_update:
-                        update_contact_submitted = st.form_submit_button("Update Contact")
-                    with col_cancel:
-                         cancel_edit = st.form_submit_button("Cancel")
-
-
-                    if update_contact_submitted:
-                        if update_contact(st.session_state.edit_contact_id, edited_contact_name):
-                                # Clear edit state and rerun on successful update
-                            st.session_state.edit_contact_id = None
-                            st.session_state.edit_contact_name = None
-                            st.rerun()
-                    elif cancel_edit:
-                            # Clear edit state and rerun on cancel
-                            st.session_state.edit_contact_id = None
-                            st.session_state.edit_contact_name = None
-                            st.rerun()
-            else:
-                    st.warning("Contact not found for editing.")
-                    st.session_state.edit_contact_id = None # Clear invalid edit state
-                    st.session_state.edit_contact_name = None
-                    st.rerun() # Rerun to clear the form area
-
-
-            # --- Delete Contact Confirmation (appears when delete is clicked) ---
-            if st.session_state.confirm_delete:
-                st.subheader("Confirm Deletion")
-                st.warning(f"Are you sure you want to delete contact '{st.session_state.contact_to_delete_name}'?")
-                col_confirm_delete, col_cancel_delete = st.columns(2)
-                with col_confirm_delete:
-                    confirm_delete_button = st.button("Yes, Delete", key="confirm_delete_button")
-                with col_cancel_delete:
-                    cancel_delete_button = st.button("Cancel", key="cancel_delete_button")
-
-                if confirm_delete_button:
-                    if delete_contact(st.session_state.delete_contact_id, st.session_state.contact_to_delete_name):
-                        # Clear delete state and rerun on successful deletion
-                        st.session_state.delete_contact_id = None
-                        st.session_state.contact_to_delete_name = None
-                        st.session_state.confirm_delete = False
-                        st.rerun()
-                elif cancel_delete_button:
-                    # Clear delete state and rerun on cancel
-                    st.session_state.delete_contact_id = None
-                    st.session_state.contact_to_delete_name = None
-                    st.session_state.confirm_delete = False
-                    st.rerun()
+        if st.session_state.edit_contact_id:
+            edit_contact_panel()
+        # --- Delete Contact Confirmation (appears when delete is clicked) ---
+        elif st.session_state.confirm_delete:
+            delete_confirm_panel()
@@ -0,0 +1,31 @@
+-- Checks whether a contact is still referenced by dispatch records and, if not,
+-- deletes it in the same transaction. Called from delete_contact() in app.py so
+-- the two usage checks and the delete cost one round-trip instead of three.
+
+create or replace function delete_contact_if_unused(cid bigint, cname text)
+returns json
+language plpgsql
+as $$
+declare
+    address_count bigint;
+    cc_count bigint;
+begin
+    select count(*) filter (where "Address" = cname),
+           count(*) filter (where "CC" ilike '%' || cname || '%')
+      into address_count, cc_count
+      from dispatch_records
+     where "Address" = cname
+        or "CC" ilike '%' || cname || '%';
+
+    if address_count > 0 or cc_count > 0 then
+        return json_build_object('status', 'in_use', 'address_count', address_count, 'cc_count', cc_count);
+    end if;
+
+    delete from contacts where id = cid;
+    if not found then
+        return json_build_object('status', 'not_found', 'address_count', 0, 'cc_count', 0);
+    end if;
+
+    return json_build_object('status', 'deleted', 'address_count', 0, 'cc_count', 0);
+end;
+$$;
@@ -0,0 +1,41 @@
+-- Stores "CC" as a text[] of contact names instead of a ', ' joined string, so
+-- "is this contact CC'd anywhere" is a GIN index probe rather than a substring scan.
+
+alter table dispatch_records
+    alter column "CC" type text[]
+    using case
+        when "CC" is null or "CC" = '' then null
+        else string_to_array("CC", ', ')
+    end;
+
+create index if not exists dispatch_cc_gin
+    on dispatch_records using gin ("CC");
+
+create or replace function delete_contact_if_unused(cid bigint, cname text)
+returns json
+language plpgsql
+as $$
+declare
+    address_count bigint;
+    cc_count bigint;
+begin
+    -- "CC" @> array[cname] is the array-containment form the GIN index supports
+    select count(*) filter (where "Address" = cname),
+           count(*) filter (where "CC" @> array[cname])
+      into address_count, cc_count
+      from dispatch_records
+     where "Address" = cname
+        or "CC" @> array[cname];
+
+    if address_count > 0 or cc_count > 0 then
+        return json_build_object('status', 'in_use', 'address_count', address_count, 'cc_count', cc_count);
+    end if;
+
+    delete from contacts where id = cid;
+    if not found then
+        return json_build_object('status', 'not_found', 'address_count', 0, 'cc_count', 0);
+    end if;
+
+    return json_build_object('status', 'deleted', 'address_count', 0, 'cc_count', 0);
+end;
+$$;
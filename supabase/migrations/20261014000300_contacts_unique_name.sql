@@ -0,0 +1,25 @@
+-- Enforces unique contact names in the database so add/rename no longer need a
+-- separate existence check from the app (one round-trip, no check-then-write race).
+-- Case-sensitive, matching the app's previous eq('name', ...) check; it is a plain
+-- column constraint so PostgREST's on_conflict=name can target it.
+
+alter table contacts
+    add constraint contacts_name_key unique (name);
+
+-- Renames a contact, reporting a name clash as a status instead of an error.
+-- Returns 'updated', 'duplicate' or 'not_found'.
+create or replace function rename_contact(cid bigint, new_name text)
+returns text
+language plpgsql
+as $$
+begin
+    update contacts set name = new_name where id = cid;
+    if not found then
+        return 'not_found';
+    end if;
+    return 'updated';
+exception
+    when unique_violation then
+        return 'duplicate';
+end;
+$$;
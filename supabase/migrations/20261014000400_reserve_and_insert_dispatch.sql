@@ -0,0 +1,47 @@
+-- Reserves a dispatch number range and inserts the record in one transaction.
+-- Replaces the app's get_next_dispatch_no() call + insert + dispatch_sequence update
+-- (three round-trips, and two concurrent inserts could read the same start number).
+-- The UPDATE ... RETURNING takes a row lock on the sequence, so concurrent callers
+-- are serialized. Returns the generated 'No' (HDU/Section/Start or HDU/Section/Start-End).
+
+create or replace function reserve_and_insert_dispatch(
+    p_section text,
+    p_date date,
+    p_address text,
+    p_cc text[],
+    p_subject text,
+    p_remarks text,
+    p_created_by text
+)
+returns text
+language plpgsql
+as $$
+declare
+    cc_count int := coalesce(cardinality(p_cc), 0);
+    start_no bigint;
+    end_no bigint;
+    generated_no text;
+begin
+    -- One number for the record plus one per CC recipient
+    update dispatch_sequence
+       set last_no = last_no + 1 + cc_count
+     where id = 1
+    returning last_no - cc_count, last_no
+         into start_no, end_no;
+
+    if not found then
+        raise exception 'dispatch_sequence row with id = 1 is missing';
+    end if;
+
+    if cc_count = 0 then
+        generated_no := format('HDU/%s/%s', p_section, start_no);
+    else
+        generated_no := format('HDU/%s/%s-%s', p_section, start_no, end_no);
+    end if;
+
+    insert into dispatch_records ("Section", "Date", "Address", "CC", "Subject", "Remarks", "No", created_by)
+    values (p_section, p_date, p_address, nullif(p_cc, '{}'), p_subject, p_remarks, generated_no, p_created_by);
+
+    return generated_no;
+end;
+$$;
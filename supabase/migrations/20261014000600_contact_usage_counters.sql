@@ -0,0 +1,84 @@
+-- Keeps per-contact usage counts in a small table maintained by a trigger on
+-- dispatch_records, so delete_contact_if_unused() does a primary-key lookup
+-- instead of scanning dispatch_records on every delete click.
+-- A counter table is used rather than a materialized view: refreshing an MV on
+-- every insert would rescan the whole register each time.
+
+create table if not exists contact_usage (
+    name text primary key,
+    address_count bigint not null default 0, -- records with this contact as "Address"
+    cc_count bigint not null default 0       -- records with this contact in "CC"
+);
+
+-- Adds delta (+1 / -1) to the counters of one record's Address and CC names
+create or replace function bump_contact_usage(p_address text, p_cc text[], delta int)
+returns void
+language sql
+as $$
+    insert into contact_usage as cu (name, address_count, cc_count)
+    select name, sum(is_address) * delta, sum(is_cc) * delta
+      from (
+            select p_address as name, 1 as is_address, 0 as is_cc
+             where p_address is not null
+            union all
+            select distinct cc_name, 0, 1
+              from unnest(p_cc) as cc_name
+           ) usage
+     group by name
+    on conflict (name) do update
+       set address_count = cu.address_count + excluded.address_count,
+           cc_count = cu.cc_count + excluded.cc_count;
+$$;
+
+create or replace function dispatch_records_track_usage()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform bump_contact_usage(old."Address", old."CC", -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform bump_contact_usage(new."Address", new."CC", 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists dispatch_records_track_usage on dispatch_records;
+create trigger dispatch_records_track_usage
+    after insert or update of "Address", "CC" or delete on dispatch_records
+    for each row execute function dispatch_records_track_usage();
+
+-- Backfill from existing records
+truncate contact_usage;
+select bump_contact_usage("Address", "CC", 1) from dispatch_records;
+
+create or replace function delete_contact_if_unused(cid bigint, cname text)
+returns json
+language plpgsql
+as $$
+declare
+    address_count bigint := 0;
+    cc_count bigint := 0;
+begin
+    select cu.address_count, cu.cc_count
+      into address_count, cc_count
+      from contact_usage cu
+     where cu.name = cname;
+
+    address_count := coalesce(address_count, 0);
+    cc_count := coalesce(cc_count, 0);
+
+    if address_count > 0 or cc_count > 0 then
+        return json_build_object('status', 'in_use', 'address_count', address_count, 'cc_count', cc_count);
+    end if;
+
+    delete from contacts where id = cid;
+    if not found then
+        return json_build_object('status', 'not_found', 'address_count', 0, 'cc_count', 0);
+    end if;
+
+    return json_build_object('status', 'deleted', 'address_count', 0, 'cc_count', 0);
+end;
+$$;
@@ -0,0 +1,9 @@
+-- The app reads user['name'] and contact['name'] without per-row key/None checks
+-- (see load_contacts and fetch_user in app.py); guarantee those columns are always present.
+
+alter table users
+    alter column username set not null,
+    alter column name set not null;
+
+alter table contacts
+    alter column name set not null;
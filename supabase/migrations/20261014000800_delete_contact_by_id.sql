@@ -0,0 +1,37 @@
+-- delete_contact_if_unused() now takes only the contact id and reads the name
+-- itself. The app used to pass both, and a name from a stale session could
+-- check usage under an old name and delete a contact that is still in use.
+-- The row lock also stops a concurrent rename between the check and the delete.
+
+drop function if exists delete_contact_if_unused(bigint, text);
+
+create or replace function delete_contact_if_unused(cid bigint)
+returns json
+language plpgsql
+as $$
+declare
+    cname text;
+    address_count bigint := 0;
+    cc_count bigint := 0;
+begin
+    select c.name into cname from contacts c where c.id = cid for update;
+    if not found then
+        return json_build_object('status', 'not_found', 'address_count', 0, 'cc_count', 0);
+    end if;
+
+    select cu.address_count, cu.cc_count
+      into address_count, cc_count
+      from contact_usage cu
+     where cu.name = cname;
+
+    address_count := coalesce(address_count, 0);
+    cc_count := coalesce(cc_count, 0);
+
+    if address_count > 0 or cc_count > 0 then
+        return json_build_object('status', 'in_use', 'address_count', address_count, 'cc_count', cc_count);
+    end if;
+
+    delete from contacts where id = cid;
+    return json_build_object('status', 'deleted', 'address_count', 0, 'cc_count', 0);
+end;
+$$;
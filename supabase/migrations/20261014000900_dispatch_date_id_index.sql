@@ -0,0 +1,8 @@
+-- Matches the View Records query: gte/lte on "Date", order by "Date" desc, id desc,
+-- one page via LIMIT/OFFSET. The planner can walk this index and stop after the
+-- page instead of sorting every record in the range (no Sort node in EXPLAIN).
+-- Not CONCURRENTLY: migrations run inside a transaction. The table is small enough
+-- for the brief lock; on a large register, build it by hand with CONCURRENTLY first.
+
+create index if not exists dispatch_records_date_id_desc
+    on dispatch_records ("Date" desc, id desc);
@@ -0,0 +1,51 @@
+"""Tests for the row-by-row Excel writer in app.py.
+
+app.py is a Streamlit script that renders its UI on import, so the writer is loaded from
+its source on its own rather than by importing the module.
+"""
+import ast
+import re
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("xlsxwriter")
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def _load_write_workbook():
+    tree = ast.parse(APP_PATH.read_text(encoding="utf-8"))
+    func = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == "_write_workbook")
+    namespace = {"BytesIO": BytesIO}
+    exec(compile(ast.Module(body=[func], type_ignores=[]), str(APP_PATH), "exec"), namespace)
+    return namespace["_write_workbook"]
+
+
+def _sheet_rows(xlsx_bytes):
+    with zipfile.ZipFile(BytesIO(xlsx_bytes)) as archive:
+        sheet = archive.read("xl/worksheets/sheet1.xml").decode("utf-8")
+    return re.findall(r"<row [^>]*>(.*?)</row>", sheet)
+
+
+def test_null_text_columns_export_as_blank_cells():
+    write_workbook = _load_write_workbook()
+    df = pd.DataFrame({
+        "No": ["HDU/DB/1", "HDU/DB/2"],
+        "Date": pd.to_datetime(["2026-10-01", "2026-10-02"], format="%Y-%m-%d"),
+        "Remarks": ["ok", float("nan")], # NULL text, as pandas 3 loads it
+        "created_by": [None, "Admin"],
+        "id": [1, 2],
+    })
+
+    rows = _sheet_rows(write_workbook(df))
+
+    assert len(rows) == 3 # header + 2 records
+    # A missing value leaves its cell out instead of failing or writing an error value
+    assert 'r="C3"' not in rows[2]
+    assert 'r="D2"' not in rows[1]
+    assert 't="e"' not in "".join(rows)
+    assert 'r="E3"' in rows[2]